@@ -1,16 +1,99 @@
+import functools
 import grammar_commons.lang_utils as lang_utils
 import grammar_commons.string_utils as string_utils
 import logging
+import re
 import regex
+import sys
 from regex.regex import Match, Pattern
-from typing import Dict, List, Set, Tuple
+from typing import Dict, FrozenSet, Iterator, List, Set, Tuple
 
 GROUPS_REGEX: str = r'(?P<atomic_groups>\((?:{language_regex}*|({language_regex}*\|{language_regex}*)*|({language_regex}*\|{language_regex}*\|{language_regex}*)*)\))'
 OPTIONALS_REGEX: str = r'(?P<atomic_optionals>\[(?:{language_regex}*|({language_regex}*\|{language_regex}*)*|({language_regex}*\|{language_regex}*\|{language_regex}*)*)\])'
 OPTIONS_REGEX: str = r'(?P<atomic_options>(?:{language_regex}*|({language_regex}*\|{language_regex}*)*|({language_regex}*\|{language_regex}*\|{language_regex}*)*))'
-WORDS_REGEX: str = r'(?P<atomic_words>{language_regex}+)'
 
-def get_potential_options(bnf: str, matched_value: str) -> Set[str]:
+# Plain character class patterns run faster on the standard re module. The
+# language templates above stay on regex, as re backtracks exponentially on
+# their nested repetitions whenever a fragment fails to match.
+BRACKETS_PATTERN: re.Pattern = re.compile(r'[()\[\]]')
+OPTIONS_SEPARATOR_PATTERN: re.Pattern = re.compile(r'\s*\|\s*')
+
+
+# The (groups, optionals, options) patterns of every language with an
+# alphabet, compiled once at import rather than on each call.
+PATTERNS_BY_LANGUAGE: Dict[str, Tuple[Pattern, Pattern, Pattern]] = {
+    language: tuple(
+        regex.compile(template.format(language_regex=language_regex))
+        for template in (GROUPS_REGEX, OPTIONALS_REGEX, OPTIONS_REGEX)
+    )
+    for language, language_regex in lang_utils.LANGUAGE_UNICODE_ALPHABET.items()
+    if language_regex
+}
+
+ALPHABET_RANGE_PATTERN: re.Pattern = re.compile(r'\\u(?P<first>[0-9A-Fa-f]{4})(?:-\\u(?P<last>[0-9A-Fa-f]{4}))?')
+# The syntax expected around the ranges of an alphabet regex, e.g. '(\s*[...]+\s*)'.
+ALPHABET_SYNTAX_PATTERN: re.Pattern = re.compile(r'\\s|[*+()\[\]]')
+
+# Every character matched by \s, the last of which is U+3000.
+WHITESPACE_CHARACTERS: FrozenSet[str] = frozenset(regex.findall(r'\s', ''.join(map(chr, range(0x3001)))))
+
+
+def _alphabet_characters(language_regex: str) -> FrozenSet[str]:
+    """
+    Returns every character within the character class of a language's
+    alphabet regex (i.e. from lang_utils.LANGUAGE_UNICODE_ALPHABET).
+
+    Only '\\uXXXX' characters and '\\uXXXX-\\uXXXX' ranges are understood, so
+    anything else raises rather than silently leaving characters out.
+    """
+
+    unparsed: str = ALPHABET_SYNTAX_PATTERN.sub(str(), ALPHABET_RANGE_PATTERN.sub(str(), language_regex))
+
+    if unparsed:
+        raise ValueError(
+            f'The alphabet regex \'{language_regex}\' has unsupported syntax \'{unparsed}\'. '
+            f'Characters must be written as \\uXXXX or \\uXXXX-\\uXXXX ranges.'
+        )
+
+    characters: Set[str] = set()
+
+    for range_match in ALPHABET_RANGE_PATTERN.finditer(language_regex):
+        first: int = int(range_match.group('first'), 16)
+        last: int = int(range_match.group('last') or range_match.group('first'), 16)
+        characters.update(map(chr, range(first, last + 1)))
+
+    return frozenset(characters)
+
+
+# The alphabet characters of every language within PATTERNS_BY_LANGUAGE.
+CHARACTERS_BY_LANGUAGE: Dict[str, FrozenSet[str]] = {
+    language: _alphabet_characters(lang_utils.LANGUAGE_UNICODE_ALPHABET[language])
+    for language in PATTERNS_BY_LANGUAGE
+}
+
+
+def _splice(bnf: str, start: int, end: int, replacement: str) -> str:
+    """
+    Replaces the span of a BNF between start and end with the replacement.
+
+    When the replacement is empty (i.e. a dropped optional or an empty option),
+    it would leave its surrounding spaces behind, so one of them is trimmed to
+    keep words single-spaced.
+    """
+
+    prefix: str = bnf[:start]
+    suffix: str = bnf[end:]
+
+    if not replacement:
+        if suffix.startswith(' ') and (not prefix or prefix.endswith(' ')):
+            suffix = suffix[1:]
+        elif not suffix and prefix.endswith(' '):
+            prefix = prefix[:-1]
+
+    return sys.intern(prefix + replacement + suffix)
+
+
+def get_potential_options(bnf: str, start: int, end: int, matched_value: str) -> Set[str]:
     """
     Takes a given BNF and a matched value for either an
     "atomic group" or "atomic optional" (see the docs for expand_bnf_recursive()).
@@ -18,23 +101,19 @@ def get_potential_options(bnf: str, matched_value: str) -> Set[str]:
     The matched value is stripped of brackets and/or parentheses and then split
     into it's corresponding options (if there are any).
 
-    Then, each instance of the original matched value is replaced with either
-    itself (minus the brackets/parentheses) or each and every one of the
-    options contained within it (if there are any).
+    Then, the span of the original matched value is spliced out and replaced
+    with either itself (minus the brackets/parentheses) or each and every one
+    of the options contained within it (if there are any). The expansions are
+    interned as they often recur across branches of the same BNF.
 
     :param bnf: BNF string operating on.
+    :param start: Index in the BNF where the matched value starts.
+    :param end: Index in the BNF where the matched value ends.
     :param matched_value: Value string of corresponding atomic group/optional.
     :return: List of BNF with all corresponding options/optional/group
     """
 
-    expansions: Set[str] = set()
-    matched_options: List[str] = split_options(matched_value)
-
-    for option in matched_options:
-        new_expansion: str = bnf.replace(matched_value, option, 1)
-        expansions.add(new_expansion)
-
-    return expansions
+    return {_splice(bnf, start, end, option) for option in split_options(matched_value)}
 
 
 def are_all_words_only(sentences: Set[str], language_code: str) -> bool:
@@ -50,9 +129,96 @@ def are_all_words_only(sentences: Set[str], language_code: str) -> bool:
     return True
 
 
+def _expand_one(fragment: str, language_code: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """
+    Performs a single expansion step on a BNF fragment: its top-level options
+    are split, then one atomic group and one atomic optional are expanded
+    (see the docs for expand_bnf_recursive()).
+
+    The expansions are classified as they are produced: those containing words
+    only are done while the rest are pending another step. A fragment the step
+    leaves untouched which is not words only (e.g. it has characters outside of
+    the language's alphabet) can never become a sentence, so it is dropped.
+
+    :param fragment: Un-finished expanded sentence of the original BNF rule.
+    :param language_code: The (lower-cased) language the BNF is expanded in.
+    :return: The fragment's (done, pending) expansions.
+    """
+
+    GROUPS_PATTERN, OPTIONALS_PATTERN, OPTIONS_PATTERN = PATTERNS_BY_LANGUAGE[language_code]
+
+    next_round: Set[str] = set()
+
+    # Expanding never introduces new pipes, parentheses or brackets, so a
+    # pattern is only run on fragments which still contain its construct.
+    option_match: Match = OPTIONS_PATTERN.fullmatch(fragment) if '|' in fragment else None
+
+    if not option_match or not option_match.group('atomic_options'):
+        option_expansions: Tuple[str, ...] = (fragment,)
+    else:
+        option_expansions = split_options(option_match.group('atomic_options'))
+
+    # Options, groups and optionals are expanded in a single pass, each result
+    # going straight into next_round rather than through intermediate sets.
+    for option_expansion in option_expansions:
+        group_match: Match = GROUPS_PATTERN.search(option_expansion) if '(' in option_expansion else None
+
+        if not group_match or not group_match.group('atomic_groups'):
+            group_expansions: Set[str] = {option_expansion}
+        else:
+            group_expansions = get_potential_options(
+                bnf=option_expansion,
+                start=group_match.start('atomic_groups'),
+                end=group_match.end('atomic_groups'),
+                matched_value=group_match.group('atomic_groups')
+            )
+
+        for expanding in group_expansions:
+            optional_match: Match = OPTIONALS_PATTERN.search(expanding) if '[' in expanding else None
+
+            if not optional_match or not optional_match.group('atomic_optionals'):
+                next_round.add(expanding)
+                continue
+
+            start: int = optional_match.start('atomic_optionals')
+            end: int = optional_match.end('atomic_optionals')
+
+            next_round.add(_splice(expanding, start, end, str()))
+            next_round.update(
+                get_potential_options(
+                    bnf=expanding,
+                    start=start,
+                    end=end,
+                    matched_value=optional_match.group('atomic_optionals')
+                )
+            )
+
+    if next_round == {fragment}:
+        if is_words_only(fragment, language_code):
+            return frozenset(next_round), frozenset()
+
+        # An empty fragment is what is left once every optional is dropped, which
+        # is expected rather than a malformed BNF.
+        if fragment:
+            logging.warning('The BNF fragment \'%s\' cannot be expanded into a sentence and is dropped.', fragment)
+
+        return frozenset(), frozenset()
+
+    done: Set[str] = set()
+    pending: Set[str] = set()
+
+    for expansion in next_round:
+        if is_words_only(expansion, language_code):
+            done.add(expansion)
+        else:
+            pending.add(expansion)
+
+    return frozenset(done), frozenset(pending)
+
+
 def expand_bnf_recursive(to_be_expanded: Set[str], language_code: str) -> List[str]:
     """
-    Performs a recursive, bottom-up expansion on a BNF rule.
+    Performs an iterative, bottom-up expansion on a BNF rule.
 
     Firstly, all BNFs in the to_be_expanded set are searched for an "atomic
     group" (i.e. in the form of "(one word or many words)" or "(some words | or | other words)")
@@ -65,193 +231,185 @@ def expand_bnf_recursive(to_be_expanded: Set[str], language_code: str) -> List[s
     which is then replaced with nothing, itself, and/or each option within the
     optional (if there are any).
 
-    Lastly, if the resulting list of expansions contains strings of words only
-    (i.e. proper sentences), then that is what will be returned.
-    Otherwise, a recursive call is made with the result as the to_be_expanded
-    parameter which will continue to grow with each recursive call.
+    Lastly, expansions containing strings of words only (i.e. proper sentences)
+    are collected as they are produced, while the remaining expansions are
+    expanded further until none are left (see the docs for iter_expansions()).
 
     :param to_be_expanded: Un-finished expanded sentences of the original BNF rule.
     :param language_code: The specified language the BNFs are to be expanded in.
     :return: The sorted list of every expansion of the given BNF rule.
     """
 
-    global GROUPS_REGEX
-    global OPTIONALS_REGEX
-    global OPTIONS_REGEX
-    global WORDS_REGEX
+    # iter_expansions() yields every sentence once, so there is nothing to dedupe.
+    return sorted(iter_expansions(to_be_expanded, language_code))
 
-    if language_code.lower() not in lang_utils.LANGUAGE_UNICODE_ALPHABET:
-        logging.error('Language code provided is not supported.')
-        return list()
-
-    if not to_be_expanded:
-        logging.error('No BNF(s) provided to expand.')
-        return list()
-
-    GROUPS_REGEX_FORMATTED: str = GROUPS_REGEX.format(language_regex=lang_utils.LANGUAGE_UNICODE_ALPHABET[language_code.lower()])
-    OPTIONALS_REGEX_FORMATTED: str = OPTIONALS_REGEX.format(language_regex=lang_utils.LANGUAGE_UNICODE_ALPHABET[language_code.lower()])
-    OPTIONS_REGEX_FORMATTED: str = OPTIONS_REGEX.format(language_regex=lang_utils.LANGUAGE_UNICODE_ALPHABET[language_code.lower()])
-
-    GROUPS_PATTERN: Pattern = regex.compile(GROUPS_REGEX_FORMATTED)
-    OPTIONALS_PATTERN: Pattern = regex.compile(OPTIONALS_REGEX_FORMATTED)
-    OPTIONS_PATTERN: Pattern = regex.compile(OPTIONS_REGEX_FORMATTED)
-
-    group_expansions: Set[str] = set()
-    group_optional_expansions: Set[str] = set()
-    option_expansions: Set[str] = set()
-
-    for expanding in to_be_expanded:
-        option_match: Match = OPTIONS_PATTERN.fullmatch(expanding)
 
-        if not option_match or option_match.group('atomic_options') is str():
-            option_expansions.add(expanding)
-            continue
+def iter_expansions(to_be_expanded: Set[str], language_code: str) -> Iterator[str]:
+    """
+    Lazily yields the expansions of a BNF rule (see the docs for expand_bnf_recursive()).
 
-        options: str = option_match.group('atomic_options')
-        option_expansions = option_expansions.union(split_options(options))
+    Un-finished expansions are walked depth-first from a stack, and each
+    sentence is yielded as soon as it is produced. Every fragment and sentence
+    produced is remembered, so each fragment is expanded and each sentence is
+    yielded exactly once, even when several branches lead to it.
 
-    for expanding in option_expansions:
-        if validate_bnf_groups(expanding):
-            group_match: Match = GROUPS_PATTERN.search(expanding)
+    Nothing is yielded if any of the BNFs has invalid groups/optionals.
 
-            if not group_match or group_match.group('atomic_groups') is str():
-                group_expansions.add(expanding)
-                continue
+    :param to_be_expanded: Un-finished expanded sentences of the original BNF rule.
+    :param language_code: The specified language the BNFs are to be expanded in.
+    :return: An iterator over every expansion of the given BNF rule.
+    """
 
-            group: str = group_match.group('atomic_groups')
-            group_expansions = group_expansions.union(get_potential_options(bnf=expanding, matched_value=group))
-        else:
-            return list()
+    if language_code.lower() not in PATTERNS_BY_LANGUAGE:
+        logging.error('Language code provided is not supported.')
+        return
 
-    for expanding in group_expansions:
-        optional_match: Match = OPTIONALS_PATTERN.search(expanding)
+    if not to_be_expanded:
+        logging.error('No BNF(s) provided to expand.')
+        return
 
-        if not optional_match or optional_match.group('atomic_optionals') is str():
-            group_optional_expansions.add(expanding)
-            continue
+    # Expanding replaces balanced groups/optionals with their balanced contents,
+    # so only the BNFs themselves need to be validated.
+    for expanding in to_be_expanded:
+        if not validate_bnf_groups(expanding):
+            return
 
-        optional: str = optional_match.group('atomic_optionals')
+    # Different branches often lead to the same fragment or sentence, which is
+    # only pushed (and therefore expanded) or yielded the first time it is seen.
+    seen: Set[str] = set()
+    stack: List[str] = list(to_be_expanded)
 
-        tmp_new_expansion: str = expanding.replace(optional, str(), 1)
-        group_optional_expansions.add(tmp_new_expansion.replace('  ', ' '))
-        group_optional_expansions = group_optional_expansions.union(
-            get_potential_options(bnf=expanding, matched_value=optional)
-        )
+    while stack:
+        done, pending = _expand_one(stack.pop(), language_code.lower())
 
-    option_expansions = None
-    group_expansions = None
+        for sentence in done:
+            if sentence not in seen:
+                seen.add(sentence)
+                yield sentence
 
-    if not are_all_words_only(group_optional_expansions, language_code.lower()):
-        return expand_bnf_recursive(group_optional_expansions, language_code)
-
-    return sorted(group_optional_expansions)
+        for fragment in pending:
+            if fragment not in seen:
+                seen.add(fragment)
+                stack.append(fragment)
 
 
 def is_words_only(string: str, language_code: str) -> bool:
     """Determines whether a string for a given language contains word characters only."""
 
-    global WORDS_REGEX
-
-    if language_code.lower() not in lang_utils.LANGUAGE_UNICODE_ALPHABET:
+    if language_code.lower() not in PATTERNS_BY_LANGUAGE:
         logging.error('Language code provided is not supported.')
         return False
 
-    WORDS_REGEX_FORMATTED: str = WORDS_REGEX.format(language_regex=lang_utils.LANGUAGE_UNICODE_ALPHABET[language_code.lower()])
-    WORDS_PATTERN: Pattern = regex.compile(WORDS_REGEX_FORMATTED)
+    # Un-finished expansions are rejected without scanning their characters.
+    if '(' in string or '[' in string or '|' in string:
+        return False
 
-    words_match: Match = regex.search(WORDS_PATTERN, string)
+    # A sentence has at least one alphabet character, and nothing but alphabet
+    # characters and whitespace (i.e. one or more of the language's regex).
+    characters: Set[str] = set(string)
+    alphabet: FrozenSet[str] = CHARACTERS_BY_LANGUAGE[language_code.lower()]
 
-    return words_match.group('atomic_words') == string
+    return not characters.isdisjoint(alphabet) and characters - WHITESPACE_CHARACTERS <= alphabet
 
 
-def split_options(string: str) -> List[str]:
+@functools.lru_cache(maxsize=4096)
+def split_options(string: str) -> Tuple[str, ...]:
     """
     Returns set of unique words within a pipe-separated string
     (i.e. option group in a BNF.)
+
+    The result is cached, hence a tuple, since the same group is usually
+    split again for each sibling fragment it appears in.
     """
 
-    cleaned_string: str = string_utils.remove_from_string(
-        string=string,
-        symbols_to_remove=['(', ')', '[', ']']
-    )
+    # Atomic groups/optionals only ever have brackets/parentheses at their ends.
+    cleaned_string: str = string.strip('()[]').strip()
 
-    return [value.strip() for value in cleaned_string.split('|')]
+    return tuple(OPTIONS_SEPARATOR_PATTERN.split(cleaned_string))
 
 
 def validate_bnf_groups(bnf: str) -> bool:
     """Validates if a given BNF has all of it's groups/optionals appropriately closed/matched."""
 
-    character_index = 0
+    opening_group: str = '('
+    closing_group: str = ')'
+    opening_optional: str = '['
+    closing_optional: str = ']'
     group_stack: List[Tuple[str, int]] = list()
-    opening: Dict[str, str] = {'group': '(', 'optional': '['}
-    closing: Dict[str, str] = {'group': ')', 'optional': ']'}
+    warnings_enabled: bool = logging.getLogger().isEnabledFor(logging.WARNING)
+
+    # Only the brackets/parentheses matter here, so every other character is
+    # skipped by the regex engine rather than walked one by one.
+    for bracket_match in BRACKETS_PATTERN.finditer(bnf):
+        char: str = bracket_match.group()
+        character_index: int = bracket_match.start()
 
-    for char in bnf:
-        if char is opening['group'] or char is opening['optional']:
+        if char == opening_group or char == opening_optional:
             group_stack.append((char, character_index))
-            character_index += 1
             continue
 
-        if char is closing['group']:
+        if char == closing_group:
             if not group_stack:
-                logging.warning(
-                    f'The BNF \'{bnf}\' has a closing \'{closing["group"]} \' as a group opener at the '
-                    f'{character_index}{string_utils.number_position_suffix(character_index)} character. '
-                    f'\'{closing["group"]}\' must be preceded with \'{opening["group"]}\'.'
-                )
+                if warnings_enabled:
+                    logging.warning(
+                        'The BNF \'%s\' has a closing \'%s \' as a group opener at the %s%s character. '
+                        '\'%s\' must be preceded with \'%s\'.',
+                        bnf, closing_group, character_index, string_utils.number_position_suffix(character_index),
+                        closing_group, opening_group
+                    )
                 return False
 
-            if group_stack[-1][0] is opening['group']:
+            if group_stack[-1][0] == opening_group:
                 group_stack.pop()
-                character_index += 1
                 continue
 
-            if group_stack[-1][0] is opening['optional']:
+            if warnings_enabled:
                 logging.warning(
-                    f'The BNF \'{bnf}\' has a mismatch at the {character_index}'
-                    f'{string_utils.number_position_suffix(character_index)} character. '
-                    f'Expected closing for \'{group_stack[-1][0]}\', received \'{closing["group"]}\'.'
+                    'The BNF \'%s\' has a mismatch at the %s%s character. Expected closing for \'%s\', received \'%s\'.',
+                    bnf, character_index, string_utils.number_position_suffix(character_index),
+                    group_stack[-1][0], closing_group
                 )
-                return False
+            return False
 
-        if char is closing['optional']:
-            if not group_stack:
+        if not group_stack:
+            if warnings_enabled:
                 logging.warning(
-                    f'The BNF \'{bnf}\' has a closing \'{closing["optional"]}\' as an optional opener at the '
-                    f'{character_index}{string_utils.number_position_suffix(character_index)} character. '
-                    f'\'{closing["optional"]}\' must be preceded with \'{opening["optional"]}\'.'
+                    'The BNF \'%s\' has a closing \'%s\' as an optional opener at the %s%s character. '
+                    '\'%s\' must be preceded with \'%s\'.',
+                    bnf, closing_optional, character_index, string_utils.number_position_suffix(character_index),
+                    closing_optional, opening_optional
                 )
-                return False
-
-            if group_stack[-1][0] is opening['optional']:
-                group_stack.pop()
-                character_index += 1
-                continue
+            return False
 
-            if group_stack[-1][0] is opening['group']:
-                logging.warning(
-                    f'The BNF \'{bnf}\' has a mismatch at the {character_index}'
-                    f'{string_utils.number_position_suffix(character_index)} character. '
-                    f'Expected closing for \'{group_stack[-1][0]}\', received \'{closing["optional"]}\'.'
-                )
-                return False
+        if group_stack[-1][0] == opening_optional:
+            group_stack.pop()
+            continue
 
-        character_index += 1
+        if warnings_enabled:
+            logging.warning(
+                'The BNF \'%s\' has a mismatch at the %s%s character. Expected closing for \'%s\', received \'%s\'.',
+                bnf, character_index, string_utils.number_position_suffix(character_index),
+                group_stack[-1][0], closing_optional
+            )
+        return False
 
     if not group_stack:
         return True
 
+    if not warnings_enabled:
+        return False
+
     for group, index in group_stack:
-        if group is opening['group']:
+        if group == opening_group:
             logging.warning(
-                f'Missing closing \'{closing["group"]}\' for \'{group}\' located at the '
-                f'{index}{string_utils.number_position_suffix(index)} character.'
+                'Missing closing \'%s\' for \'%s\' located at the %s%s character.',
+                closing_group, group, index, string_utils.number_position_suffix(index)
             )
 
-        if group is opening['optional']:
+        if group == opening_optional:
             logging.warning(
-                f'Missing closing \'{closing["optional"]}\' for \'{group}\' located at the '
-                f'{index}{string_utils.number_position_suffix(index)} character.'
+                'Missing closing \'%s\' for \'%s\' located at the %s%s character.',
+                closing_optional, group, index, string_utils.number_position_suffix(index)
             )
 
     return False
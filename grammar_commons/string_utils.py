@@ -1,5 +1,5 @@
 import datetime
-import regex
+import re
 from typing import List
 
 """String utility module for common string operations."""
@@ -8,13 +8,13 @@ from typing import List
 def number_position_suffix(number: int):
     """Returns the appropriate suffix associated with the given integer."""
 
-    if number % 10 is 1:
+    if number % 10 == 1:
         return 'st'
 
-    if number % 10 is 2:
+    if number % 10 == 2:
         return 'nd'
 
-    if number % 10 is 3:
+    if number % 10 == 3:
         return 'rd'
 
     return 'th'
@@ -27,6 +27,6 @@ def snake_case(string: str) -> str:
     :return: The snake-cased version of the input string.
     """
 
-    sub = regex.sub(pattern=r'(.)([A-Z][a-z]+)', repl=r'\1_\2', string=string)
+    sub = re.sub(pattern=r'(.)([A-Z][a-z]+)', repl=r'\1_\2', string=string)
 
-    return regex.sub(pattern=r'([a-z0-9])([A-Z])', repl=r'\1_\2', string=sub).lower()
+    return re.sub(pattern=r'([a-z0-9])([A-Z])', repl=r'\1_\2', string=sub).lower()